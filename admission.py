@@ -0,0 +1,184 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+
+
+def refill(tokens, updated, now, rate, capacity):
+    """Token bucket arithmetic shared by both backends"""
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class LocalBackend:
+    """Process-local buckets, slots and counters (one set per worker)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = {}
+        self._counters = {}
+
+    def take_token(self, key, rate, capacity):
+        """Return 0 if a token was taken, otherwise seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = refill(tokens, updated, now, rate, capacity)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def acquire_slot(self, name, limit):
+        with self._lock:
+            if self._slots.get(name, 0) >= limit:
+                return None
+            self._slots[name] = self._slots.get(name, 0) + 1
+            return name
+
+    def release_slot(self, name, token):
+        with self._lock:
+            self._slots[name] = max(self._slots.get(name, 0) - 1, 0)
+
+    def incr(self, counter):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + 1
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+class SQLiteBackend:
+    """Buckets, slots and counters in a small SQLite file shared by all workers on a host"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)",
+        "CREATE TABLE IF NOT EXISTS slots (token TEXT PRIMARY KEY, name TEXT, acquired REAL)",
+        "CREATE INDEX IF NOT EXISTS ix_slots_name ON slots (name, acquired)",
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)",
+    )
+
+    def __init__(self, path, slot_lease=120):
+        self.path = path
+        # A worker that dies mid-request never releases its slot; leases expire instead
+        self.slot_lease = slot_lease
+        self._local = threading.local()
+
+    def _conn(self):
+        # Connections must not cross a fork or be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _transaction(self, work):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def take_token(self, key, rate, capacity):
+        now = time.time()
+
+        def work(conn):
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = refill(*(row or (capacity, now)), now, rate, capacity)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if tokens >= 1:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            return wait
+
+        return self._transaction(work)
+
+    def acquire_slot(self, name, limit):
+        now = time.time()
+
+        def work(conn):
+            conn.execute("DELETE FROM slots WHERE name = ? AND acquired < ?", (name, now - self.slot_lease))
+            (in_use,) = conn.execute("SELECT COUNT(*) FROM slots WHERE name = ?", (name,)).fetchone()
+            if in_use >= limit:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute("INSERT INTO slots (token, name, acquired) VALUES (?, ?, ?)", (token, name, now))
+            return token
+
+        return self._transaction(work)
+
+    def release_slot(self, name, token):
+        self._conn().execute("DELETE FROM slots WHERE token = ?", (token,))
+
+    def incr(self, counter):
+        self._conn().execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1", (counter,))
+
+    def counters(self):
+        return dict(self._conn().execute("SELECT name, value FROM counters").fetchall())
+
+
+class AdmissionControl:
+    """Per-user token buckets plus global caps on concurrent smile scoring.
+
+    Uploads and live meter frames draw on separate slot pools, so webcam
+    frames can't crowd out uploads. Requests over the limit are refused
+    straight away with 429 (rate) or 503 (busy) and a Retry-After header,
+    rather than queueing for a worker.
+    """
+
+    def __init__(self, backend, scoring_limit=4, live_limit=2, busy_retry_after=2):
+        self.backend = backend
+        self.pools = {'scoring': scoring_limit, 'live': live_limit}
+        self.busy_retry_after = busy_retry_after
+
+    def limit(self, name, per_minute, burst, pool=None):
+        """Decorate a view; only POST requests are counted. `pool` names a slot pool to hold while it runs"""
+        rate = per_minute / 60.0
+
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if request.method != 'POST':
+                    return view(*args, **kwargs)
+
+                who = current_user.get_id() if current_user.is_authenticated else request.remote_addr
+                wait = self.backend.take_token(f"{name}:{who}", rate, burst)
+                if wait:
+                    self.backend.incr(f"rejected_rate:{name}")
+                    raise TooManyRequests(retry_after=math.ceil(wait))
+
+                if pool is None:
+                    self.backend.incr(f"accepted:{name}")
+                    return view(*args, **kwargs)
+
+                token = self.backend.acquire_slot(pool, self.pools[pool])
+                if token is None:
+                    self.backend.incr(f"rejected_busy:{name}")
+                    raise ServiceUnavailable(retry_after=self.busy_retry_after)
+                self.backend.incr(f"accepted:{name}")
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.backend.release_slot(pool, token)
+            return wrapped
+        return decorator
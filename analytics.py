@@ -0,0 +1,65 @@
+import numpy as np
+
+MAX_SCORE = 10
+
+
+class RollupAccumulator:
+    """Vectorized (user, day, score) -> photo count aggregation for the backfill job"""
+
+    def __init__(self):
+        self._keys = np.empty((0, 3), dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+
+    def add(self, user_ids, uploaded_at, scores):
+        """Fold one chunk of Photo columns into the running totals"""
+        if len(user_ids) == 0:
+            return
+        days = np.array(uploaded_at, dtype='datetime64[D]').astype(np.int64)
+        scores = np.clip(np.asarray(scores, dtype=np.int64), 0, MAX_SCORE)
+        keys = np.column_stack((np.asarray(user_ids, dtype=np.int64), days, scores))
+
+        keys, counts = np.unique(keys, axis=0, return_counts=True)
+        self._merge(keys, counts)
+
+    def _merge(self, keys, counts):
+        all_keys = np.concatenate((self._keys, keys))
+        all_counts = np.concatenate((self._counts, counts))
+        self._keys, inverse = np.unique(all_keys, axis=0, return_inverse=True)
+        self._counts = np.bincount(inverse.ravel(), weights=all_counts,
+                                   minlength=len(self._keys)).astype(np.int64)
+
+    def rows(self):
+        """Yield (user_id, day, score, count) tuples ready for insertion"""
+        days = self._keys[:, 1].astype('datetime64[D]').tolist()
+        for (user_id, _, score), day, count in zip(self._keys.tolist(), days, self._counts.tolist()):
+            yield user_id, day, score, count
+
+    def global_rows(self):
+        """Yield (day, score, count) tuples summed over all users"""
+        if not len(self._keys):
+            return
+        keys, inverse = np.unique(self._keys[:, 1:], axis=0, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=self._counts, minlength=len(keys)).astype(np.int64)
+        days = keys[:, 0].astype('datetime64[D]').tolist()
+        for (_, score), day, count in zip(keys.tolist(), days, counts.tolist()):
+            yield day, score, count
+
+
+def daily_series(rows):
+    """Turn (day, uploads, score_sum) rows into uploads and average score per day"""
+    return [
+        {
+            'day': day.isoformat(),
+            'uploads': int(uploads),
+            'average_score': round(score_sum / uploads, 2) if uploads else 0,
+        }
+        for day, uploads, score_sum in rows
+    ]
+
+
+def histogram(rows):
+    """Dense score histogram (index = smile score) from sparse (score, count) rows"""
+    counts = np.zeros(MAX_SCORE + 1, dtype=np.int64)
+    for score, count in rows:
+        counts[score] += count
+    return counts.tolist()
@@ -1,20 +1,49 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Flask, Request, render_template, request, redirect, url_for, flash, session, current_app, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.exceptions import RequestEntityTooLarge, TooManyRequests, ServiceUnavailable
+from sqlalchemy import select, update, delete, insert, union_all, func, or_, and_, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from functools import wraps
+import click
+import csv
+import io
 import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from live_meter import LiveMeter, LocalSessionStore, SQLiteSessionStore
+from admission import AdmissionControl, LocalBackend, SQLiteBackend
+from upload_validator import sniff_image, sniff_stream, Base64Stream, HeadCheckedFile, UploadRejected
+from analytics import RollupAccumulator, daily_series, histogram
+from image_hash import to_signed, hamming, split_chunks, chunk_probes, probe_radius
 
 # ------------------ APP CONFIG ------------------
+class UploadRequest(Request):
+    """Sniffs each uploaded file while the form is parsed, so a bad upload is refused
+    from its first bytes instead of after the whole body has been spooled to disk"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HeadCheckedFile(super()._get_file_stream(total_content_length, content_type, filename, content_length))
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-for-smilesphere')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///smilesphere.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SMILESPHERE_DATABASE_URI', 'sqlite:///smilesphere.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'images', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
+app.config['LIVE_FRAME_MAX_BYTES'] = 512 * 1024  # compressed webcam frames only
+# DCT pHash bits; closer uploads earn no coins. 10 catches 98% of 1-2% crops and 85% of
+# 5% crops of the sample uploads with no unrelated matches (python check_duplicate_hash.py)
+app.config['DUPLICATE_MAX_DISTANCE'] = 10
+# 'local' limits each worker separately; 'sqlite' shares limits between workers on one host
+app.config['ADMISSION_BACKEND'] = os.environ.get('SMILESPHERE_ADMISSION_BACKEND', 'local')
+app.config['SCORING_CONCURRENCY'] = int(os.environ.get('SMILESPHERE_SCORING_CONCURRENCY', 4))
+# Live meter frames get their own, smaller pool so open webcams can't starve uploads
+app.config['LIVE_CONCURRENCY'] = int(os.environ.get('SMILESPHERE_LIVE_CONCURRENCY', 2))
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -25,6 +54,17 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# The 'sqlite' backend also shares live meter sessions, so any worker can take a client's next frame
+if app.config['ADMISSION_BACKEND'] == 'sqlite':
+    os.makedirs(app.instance_path, exist_ok=True)
+    admission_backend = SQLiteBackend(os.path.join(app.instance_path, 'admission.db'))
+    live_meter = LiveMeter(SQLiteSessionStore(os.path.join(app.instance_path, 'live_meter.db')))
+else:
+    admission_backend = LocalBackend()
+    live_meter = LiveMeter(LocalSessionStore())
+admission = AdmissionControl(admission_backend, scoring_limit=app.config['SCORING_CONCURRENCY'],
+                             live_limit=app.config['LIVE_CONCURRENCY'])
+
 # ------------------ MODELS ------------------
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,15 +90,49 @@ class User(UserMixin, db.Model):
 
 
 class Photo(db.Model):
+    __table_args__ = (
+        # A user's photos, newest first (dashboard/profile pagination)
+        db.Index('ix_photo_user_uploaded_at', 'user_id', 'uploaded_at'),
+    ) + tuple(
+        # Multi-index hashing: a near-duplicate shares (almost) one 16-bit chunk exactly
+        db.Index(f'ix_photo_user_phash_{i}', 'user_id', f'phash_{i}') for i in range(4)
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     smile_score = db.Column(db.Integer, default=0)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     public = db.Column(db.Boolean, default=True)
+    phash = db.Column(db.BigInteger)
+    phash_0 = db.Column(db.Integer)
+    phash_1 = db.Column(db.Integer)
+    phash_2 = db.Column(db.Integer)
+    phash_3 = db.Column(db.Integer)
     comments = db.relationship('Comment', backref='photo', lazy=True)
     reactions = db.relationship('Reaction', backref='photo', lazy=True)
 
+    def set_phash(self, value):
+        self.phash = to_signed(value)
+        self.phash_0, self.phash_1, self.phash_2, self.phash_3 = split_chunks(value)
+
+
+def find_near_duplicate(user_id, phash, max_distance):
+    """Return the id of an earlier photo by this user within max_distance bits, if any"""
+    radius = probe_radius(max_distance)
+    columns = (Photo.phash_0, Photo.phash_1, Photo.phash_2, Photo.phash_3)
+    # One select per chunk so each is an equality+IN lookup on its own (user_id, phash_i)
+    # index. A single OR across the chunks only uses all four indexes once ANALYZE
+    # has run; without statistics SQLite scans every photo the user has.
+    candidates = db.session.execute(union_all(*(
+        select(Photo.id, Photo.phash).where(Photo.user_id == user_id, column.in_(chunk_probes(chunk, radius)))
+        for column, chunk in zip(columns, split_chunks(phash))
+    )))
+    for photo_id, other in candidates:
+        if other is not None and hamming(other, phash) <= max_distance:
+            return photo_id
+    return None
+
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -87,6 +161,13 @@ class Reward(db.Model):
 
 
 class Redemption(db.Model):
+    __table_args__ = (
+        # Work queue for admins: pending items in FIFO order
+        db.Index('ix_redemption_status_redeemed_at', 'status', 'redeemed_at'),
+        # A user's redemption history, newest first
+        db.Index('ix_redemption_user_redeemed_at', 'user_id', 'redeemed_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     reward_id = db.Column(db.Integer, db.ForeignKey('reward.id'), nullable=False)
@@ -94,10 +175,70 @@ class Redemption(db.Model):
     status = db.Column(db.String(20), default='pending')
 
 
+class DailyScoreRollup(db.Model):
+    """Number of photos per user, upload day and smile score; all stats are read from here"""
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'score', name='uq_rollup_user_day_score'),
+        db.Index('ix_rollup_day', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class GlobalDailyScoreRollup(db.Model):
+    """Number of photos per upload day and smile score across all users"""
+    __table_args__ = (
+        db.UniqueConstraint('day', 'score', name='uq_global_rollup_day_score'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DataMigration(db.Model):
+    """One-off data migrations already applied to this database"""
+    name = db.Column(db.String(80), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def bump_rollup(user_id, uploaded_at, score, delta):
+    """Adjust the rollups for one uploaded (+1) or deleted (-1) photo, in the caller's transaction"""
+    day = (uploaded_at or datetime.utcnow()).date()
+    score = max(0, min(int(score or 0), 10))
+    targets = (
+        (DailyScoreRollup, {'user_id': user_id, 'day': day, 'score': score}),
+        (GlobalDailyScoreRollup, {'day': day, 'score': score}),
+    )
+    for model, keys in targets:
+        if delta > 0:
+            stmt = sqlite_insert(model).values(count=delta, **keys)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={'count': model.count + delta},
+            )
+        else:
+            stmt = (
+                update(model)
+                .where(*(getattr(model, column) == value for column, value in keys.items()))
+                .values(count=func.max(model.count + delta, 0))
+            )
+        db.session.execute(stmt)
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+
+def wants_json():
+    return request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'application/json'
+
 # ------------------ ROUTES ------------------
 
 @app.route('/')
@@ -156,11 +297,97 @@ def logout():
     return redirect(url_for('index'))
 
 
+PHOTO_PAGE_SIZE = 12
+
+
+def _parse_cursor(cursor):
+    """Decode a '<iso timestamp>_<id>' keyset cursor, or return None"""
+    try:
+        stamp, _, row_id = (cursor or '').rpartition('_')
+        return datetime.fromisoformat(stamp), int(row_id)
+    except ValueError:
+        return None
+
+
+def user_summary(user_id):
+    """Photo count, average/best score and coins earned/spent in a single query"""
+    # Rejected redemptions were refunded, so they don't count as spent
+    kept = and_(Redemption.user_id == user_id, Redemption.status != 'rejected')
+    redeemed = select(func.count(Redemption.id)).where(kept).scalar_subquery()
+    spent = (
+        select(func.coalesce(func.sum(Reward.cost), 0))
+        .join(Redemption, Redemption.reward_id == Reward.id)
+        .where(kept)
+        .scalar_subquery()
+    )
+    return db.session.execute(
+        select(func.count(Photo.id).label('photo_count'),
+               func.avg(Photo.smile_score).label('average_score'),
+               func.max(Photo.smile_score).label('best_score'),
+               func.coalesce(func.sum(Photo.smile_score), 0).label('coins_earned'),
+               redeemed.label('redeemed'),
+               spent.label('coins_spent'))
+        .where(Photo.user_id == user_id)
+    ).one()
+
+
+def newest_first_page(query, time_column, id_column, before, page_size=PHOTO_PAGE_SIZE, scalars=False):
+    """Keyset page of `query` ordered newest first; returns (rows, cursor for the next page)"""
+    if before:
+        stamp, row_id = before
+        query = query.where(or_(time_column < stamp, and_(time_column == stamp, id_column < row_id)))
+    result = db.session.execute(query.order_by(time_column.desc(), id_column.desc()).limit(page_size + 1))
+    rows = result.scalars().all() if scalars else result.all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = f"{getattr(last, time_column.key).isoformat()}_{getattr(last, id_column.key)}"
+    return rows, next_cursor
+
+
+def photo_page(user_id, before=None):
+    return newest_first_page(select(Photo).where(Photo.user_id == user_id),
+                             Photo.uploaded_at, Photo.id, before, scalars=True)
+
+
+def redemption_page(user_id, before=None):
+    return newest_first_page(
+        select(Redemption.id, Redemption.redeemed_at, Redemption.status,
+               Reward.name.label('reward_name'), Reward.cost)
+        .join(Reward, Redemption.reward_id == Reward.id)
+        .where(Redemption.user_id == user_id),
+        Redemption.redeemed_at, Redemption.id, before)
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    photos = Photo.query.filter_by(user_id=current_user.id).order_by(Photo.uploaded_at.desc()).all()
-    return render_template('dashboard.html', photos=photos)
+    photos, next_cursor = photo_page(current_user.id)
+    return render_template('dashboard.html', photos=photos, next_cursor=next_cursor,
+                           summary=user_summary(current_user.id))
+
+
+@app.route('/me/photos')
+@login_required
+def my_photos():
+    """Next page of the current user's photos as an HTML fragment (lazy loading)"""
+    photos, next_cursor = photo_page(current_user.id, _parse_cursor(request.args.get('before')))
+    layout = 'grid' if request.args.get('layout') == 'grid' else 'list'
+    html = render_template(f'_photo_{layout}_items.html', photos=photos)
+    headers = {'X-Next-Url': url_for('my_photos', before=next_cursor, layout=layout)} if next_cursor else {}
+    return html, 200, headers
+
+
+@app.route('/me/redemptions')
+@login_required
+def my_redemptions():
+    """Next page of the current user's redemption history as table rows"""
+    redemptions, next_cursor = redemption_page(current_user.id, _parse_cursor(request.args.get('before')))
+    html = render_template('_redemption_rows.html', redemptions=redemptions)
+    headers = {'X-Next-Url': url_for('my_redemptions', before=next_cursor)} if next_cursor else {}
+    return html, 200, headers
 
 
 @app.route('/photo/<int:photo_id>')
@@ -172,50 +399,115 @@ def view_photo(photo_id):
 
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
+@admission.limit('upload', per_minute=10, burst=5, pool='scoring')
 def upload():
     if request.method == 'POST':
         file_path = None
 
-        # Webcam/base64 capture
-        if 'photo' in request.form and request.form.get('photo', '').startswith('data:image'):
-            import base64, re
-            img_data = re.sub(r'^data:image/\w+;base64,', '', request.form['photo'])
-            image_bytes = base64.b64decode(img_data)
-            filename = f"{uuid.uuid4()}.png"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            with open(file_path, 'wb') as f:
-                f.write(image_bytes)
-        else:
-            # File upload
-            file = request.files.get('photo')
-            if not file or file.filename == '':
-                flash('No selected file')
-                return redirect(request.url)
-            filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-
-        # Smile detector (assume you have this module)
-        from smile_detector import SmileDetector
-        detector = SmileDetector()
-        result = detector.analyze_image(file_path)
+        try:
+            # Webcam/base64 capture
+            if 'photo' in request.form and request.form.get('photo', '').startswith('data:image'):
+                import base64, binascii, re
+                img_data = re.sub(r'^data:image/\w+;base64,', '', request.form['photo'])
+                try:
+                    # Only decode enough base64 to see the header before touching the rest
+                    info = sniff_stream(Base64Stream(img_data))
+                    image_bytes = base64.b64decode(img_data)
+                except (binascii.Error, ValueError):
+                    raise UploadRejected('invalid_encoding', "We couldn't read the captured photo.")
+                filename = f"{uuid.uuid4()}.{info.extension}"
+                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                with open(file_path, 'wb') as f:
+                    f.write(image_bytes)
+            else:
+                # File upload
+                file = request.files.get('photo')
+                if not file or file.filename == '':
+                    flash('No selected file')
+                    return redirect(request.url)
+                info = file.stream.image_info()
+                file.stream.seek(0)
+                # Trust the bytes, not the client, for the extension
+                stem = os.path.splitext(secure_filename(file.filename))[0]
+                filename = f"{uuid.uuid4()}_{stem}.{info.extension}" if stem else f"{uuid.uuid4()}.{info.extension}"
+                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                file.save(file_path)
+        except UploadRejected as rejection:
+            if wants_json():
+                return jsonify(rejection.to_dict()), rejection.status
+            flash(rejection.message)
+            return redirect(request.url)
+
+        # Smile detector is loaded once per process and shared between requests
+        from smile_detector import get_detector
+        result = get_detector().analyze_image(file_path)
         smile_score = int(result.get('score', 0))
+        phash = result.get('phash')
+
+        duplicate_of = None
+        if phash is not None:
+            duplicate_of = find_near_duplicate(current_user.id, phash, app.config['DUPLICATE_MAX_DISTANCE'])
+            if duplicate_of is not None:
+                smile_score = 0
 
         new_photo = Photo(
             filename=os.path.basename(file_path),
             smile_score=smile_score,
             user_id=current_user.id,
+            uploaded_at=datetime.utcnow(),
             public=bool(request.form.get('public'))
         )
+        if phash is not None:
+            new_photo.set_phash(phash)
         db.session.add(new_photo)
         current_user.smile_coins = (current_user.smile_coins or 0) + smile_score
+        bump_rollup(current_user.id, new_photo.uploaded_at, smile_score, +1)
         db.session.commit()
-        flash(f'Photo uploaded! You earned {smile_score} Smile Coins!')
+        live_meter.end(current_user.id)
+        if duplicate_of is not None:
+            flash("Looks like you've shared this photo before, so it earns no Smile Coins this time.")
+        else:
+            flash(f'Photo uploaded! You earned {smile_score} Smile Coins!')
         return redirect(url_for('dashboard'))
 
     return render_template('upload.html')
 
 
+@app.route('/upload/live/frame', methods=['POST'])
+@login_required
+@admission.limit('live_frame', per_minute=600, burst=30, pool='live')
+def live_frame():
+    """Score one compressed webcam frame for the live smile meter (nothing is saved)"""
+    frame = request.get_data(cache=False)
+    if not frame:
+        return jsonify(error='Empty frame'), 400
+    if len(frame) > app.config['LIVE_FRAME_MAX_BYTES']:
+        return jsonify(error='Frame too large'), 413
+    try:
+        sniff_image(frame)
+    except UploadRejected as rejection:
+        return jsonify(rejection.to_dict()), rejection.status
+
+    from smile_detector import get_detector
+    result, session_state = live_meter.process(current_user.id, get_detector(), frame)
+    if result is None:
+        # A frame from this client is still being scored, drop this one
+        return jsonify(skipped=True, smoothed=round(session_state.smoothed_score, 1)), 429
+
+    return jsonify(
+        score=result['score'],
+        message=result['message'],
+        smoothed=round(session_state.smoothed_score, 1),
+        **session_state.stats()
+    )
+
+
+@app.route('/upload/live/stats')
+@login_required
+def live_stats():
+    return jsonify(live_meter.stats())
+
+
 @app.route('/photo/<int:photo_id>/delete', methods=['POST'])
 @login_required
 def delete_photo(photo_id):
@@ -232,6 +524,7 @@ def delete_photo(photo_id):
     if current_user.smile_coins < 0:
         current_user.smile_coins = 0
 
+    bump_rollup(photo.user_id, photo.uploaded_at, photo.smile_score, -1)
     db.session.delete(photo)
     db.session.commit()
     flash("Photo deleted successfully.")
@@ -288,6 +581,7 @@ def redeem_reward(reward_id):
 # ------------------ COMMENTS & REACTIONS ------------------
 @app.route('/photo/<int:photo_id>/comment', methods=['POST'])
 @login_required
+@admission.limit('comment', per_minute=20, burst=10)
 def add_comment(photo_id):
     Photo.query.get_or_404(photo_id)
     content = (request.form.get('content') or '').strip()
@@ -302,6 +596,7 @@ def add_comment(photo_id):
 
 @app.route('/photo/<int:photo_id>/reaction', methods=['POST'])
 @login_required
+@admission.limit('reaction', per_minute=60, burst=20)
 def add_reaction(photo_id):
     photo = Photo.query.get_or_404(photo_id)
     reaction_type = request.form.get('reaction_type', 'like')
@@ -345,12 +640,219 @@ def delete_comment(comment_id):
 @app.route('/profile')
 @login_required
 def profile():
-    photos = current_user.photos
-    redemptions = Redemption.query.filter_by(user_id=current_user.id).join(Reward).all()
-    return render_template('profile.html', photos=photos, redemptions=redemptions)
+    photos, next_photos = photo_page(current_user.id)
+    redemptions, next_redemptions = redemption_page(current_user.id)
+    return render_template('profile.html', photos=photos, next_photos=next_photos,
+                           redemptions=redemptions, next_redemptions=next_redemptions,
+                           summary=user_summary(current_user.id))
+
+
+# ------------------ STATS ------------------
+def _stats(user_id=None, days=30):
+    """Trend and histogram for the last `days` days, from the rollup tables only (never scans Photo)"""
+    # Rollup days come from utcnow(), so the window must too
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    if user_id is None:
+        rollup, window = GlobalDailyScoreRollup, [GlobalDailyScoreRollup.day >= since]
+    else:
+        rollup, window = DailyScoreRollup, [DailyScoreRollup.user_id == user_id, DailyScoreRollup.day >= since]
+
+    uploads = func.sum(rollup.count)
+    trend = db.session.execute(
+        select(rollup.day, uploads, func.sum(rollup.score * rollup.count))
+        .where(*window)
+        .group_by(rollup.day)
+        .order_by(rollup.day)
+    ).all()
+    hist = db.session.execute(
+        select(rollup.score, uploads)
+        .where(*window)
+        .group_by(rollup.score)
+    ).all()
+    return {'days': days, 'daily': daily_series(trend), 'histogram': histogram(hist)}
+
+
+def _stats_days():
+    return max(1, min(request.args.get('days', 30, type=int), 365))
+
+
+@app.route('/stats')
+@login_required
+def stats():
+    days = _stats_days()
+    return render_template('stats.html', mine=_stats(current_user.id, days), everyone=_stats(None, days))
+
+
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    days = _stats_days()
+    if request.args.get('scope') == 'global':
+        return jsonify(_stats(None, days))
+    return jsonify(_stats(current_user.id, days))
+
+
+# ------------------ ADMIN ------------------
+REDEMPTION_PAGE_SIZE = 50
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated or not current_user.is_admin:
+            flash("You don't have permission to access that page.")
+            return redirect(url_for('dashboard'))
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def _redemption_selection(form):
+    """Build the WHERE clause for a bulk action without loading any rows"""
+    if form.get('scope') == 'all':
+        # Everything pending up to (and including) the given queue position
+        until = _parse_cursor(form.get('until'))
+        if until is None:
+            return None
+        stamp, row_id = until
+        return or_(Redemption.redeemed_at < stamp,
+                   and_(Redemption.redeemed_at == stamp, Redemption.id <= row_id))
+
+    ids = [int(i) for i in form.getlist('ids') if i.isdigit()]
+    if not ids:
+        return None
+    return Redemption.id.in_(ids)
+
+
+@app.route('/admin/redemptions')
+@login_required
+@admin_required
+def admin_redemptions():
+    status = request.args.get('status', 'pending')
+    after = _parse_cursor(request.args.get('after'))
+
+    query = (
+        select(Redemption.id, Redemption.redeemed_at, Redemption.status,
+               User.username, Reward.name.label('reward_name'), Reward.cost)
+        .join(User, Redemption.user_id == User.id)
+        .join(Reward, Redemption.reward_id == Reward.id)
+        .where(Redemption.status == status)
+        .order_by(Redemption.redeemed_at, Redemption.id)
+        .limit(REDEMPTION_PAGE_SIZE + 1)
+    )
+    if after:
+        stamp, row_id = after
+        query = query.where(or_(Redemption.redeemed_at > stamp,
+                                and_(Redemption.redeemed_at == stamp, Redemption.id > row_id)))
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if len(rows) > REDEMPTION_PAGE_SIZE:
+        rows = rows[:REDEMPTION_PAGE_SIZE]
+        next_cursor = f"{rows[-1].redeemed_at.isoformat()}_{rows[-1].id}"
+
+    pending_count = db.session.scalar(
+        select(func.count()).select_from(Redemption).where(Redemption.status == 'pending'))
+    return render_template('admin_redemptions.html', rows=rows, status=status,
+                           next_cursor=next_cursor, pending_count=pending_count)
+
+
+@app.route('/admin/redemptions/bulk', methods=['POST'])
+@login_required
+@admin_required
+def admin_redemptions_bulk():
+    action = request.form.get('action')
+    if action not in ('approve', 'reject'):
+        flash('Unknown action.')
+        return redirect(url_for('admin_redemptions'))
+
+    selection = _redemption_selection(request.form)
+    if selection is None:
+        flash('No redemptions selected.')
+        return redirect(url_for('admin_redemptions'))
+
+    pending = and_(Redemption.status == 'pending', selection)
+
+    if action == 'reject':
+        # Refund every affected user in one statement, before the rows leave 'pending'
+        refund = (
+            select(func.coalesce(func.sum(Reward.cost), 0))
+            .select_from(Redemption)
+            .join(Reward, Redemption.reward_id == Reward.id)
+            .where(Redemption.user_id == User.id, pending)
+            .correlate(User)
+            .scalar_subquery()
+        )
+        db.session.execute(
+            update(User)
+            .where(User.id.in_(select(Redemption.user_id).where(pending)))
+            .values(smile_coins=func.coalesce(User.smile_coins, 0) + refund)
+            .execution_options(synchronize_session=False)
+        )
+
+    new_status = 'approved' if action == 'approve' else 'rejected'
+    result = db.session.execute(
+        update(Redemption)
+        .where(pending)
+        .values(status=new_status)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    flash(f'{result.rowcount} redemption(s) {new_status}.')
+    return redirect(url_for('admin_redemptions'))
+
+
+@app.route('/admin/redemptions/approved.csv')
+@login_required
+@admin_required
+def admin_redemptions_export():
+    query = (
+        select(Redemption.id, Redemption.redeemed_at, User.username, User.email,
+               Reward.name, Reward.cost)
+        .join(User, Redemption.user_id == User.id)
+        .join(Reward, Redemption.reward_id == Reward.id)
+        .where(Redemption.status == 'approved')
+        .order_by(Redemption.redeemed_at, Redemption.id)
+        .execution_options(yield_per=1000)
+    )
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['redemption_id', 'redeemed_at', 'username', 'email', 'reward', 'cost'])
+        for row in db.session.execute(query):
+            writer.writerow([row.id, row.redeemed_at.isoformat(), row.username, row.email, row.name, row.cost])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=approved_redemptions.csv'})
+
+
+@app.route('/admin/admission')
+@login_required
+@admin_required
+def admin_admission():
+    return jsonify(backend=app.config['ADMISSION_BACKEND'], counters=admission_backend.counters())
 
 
 # ------------------ ERROR HANDLERS ------------------
+@app.errorhandler(TooManyRequests)
+@app.errorhandler(ServiceUnavailable)
+def handle_load_shed(e):
+    headers = {'Retry-After': str(e.retry_after)} if e.retry_after else {}
+    if wants_json():
+        return jsonify(error=e.name, retry_after=e.retry_after), e.code, headers
+    if e.code == 429:
+        description = f"You're going a little fast! Please wait {e.retry_after} seconds and try again."
+    else:
+        description = f"We're busy analysing other smiles right now. Please try again in {e.retry_after} seconds."
+    return render_template('error.html', error_code=e.code, error_name=e.name,
+                           error_description=description), e.code, headers
+
+
 @app.errorhandler(RequestEntityTooLarge)
 def handle_file_too_large(e):
     flash("File is too large! Max 50MB allowed.")
@@ -358,12 +860,168 @@ def handle_file_too_large(e):
 
 
 # ------------------ DB COMMANDS ------------------
+def upgrade_schema():
+    """create_all() skips existing tables, so add any columns and indexes they are missing,
+    then run any pending data migrations"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    run_data_migrations()
+
+
 @app.cli.command('init-db')
 def init_db_command():
+    """Create missing tables, columns and indexes; safe to run on every start"""
     db.create_all()
+    upgrade_schema()
     print('Initialized the database.')
 
 
+def backfill_rollups(chunk_size=50000):
+    """Rebuild the per-user and global daily score rollups from the Photo table, a chunk at a time"""
+    accumulator = RollupAccumulator()
+    last_id = 0
+    while True:
+        chunk = db.session.execute(
+            select(Photo.id, Photo.user_id, Photo.uploaded_at, Photo.smile_score)
+            .where(Photo.id > last_id)
+            .order_by(Photo.id)
+            .limit(chunk_size)
+        ).all()
+        if not chunk:
+            break
+        ids, user_ids, uploaded_at, scores = zip(*chunk)
+        uploaded_at = [stamp or datetime.utcnow() for stamp in uploaded_at]
+        accumulator.add(user_ids, uploaded_at, [score or 0 for score in scores])
+        last_id = ids[-1]
+
+    rows = [dict(user_id=u, day=d, score=s, count=c) for u, d, s, c in accumulator.rows()]
+    global_rows = [dict(day=d, score=s, count=c) for d, s, c in accumulator.global_rows()]
+    db.session.execute(delete(DailyScoreRollup))
+    db.session.execute(delete(GlobalDailyScoreRollup))
+    if rows:
+        db.session.execute(insert(DailyScoreRollup), rows)
+        db.session.execute(insert(GlobalDailyScoreRollup), global_rows)
+    db.session.commit()
+    return len(rows)
+
+
+def run_data_migrations():
+    """Apply each data migration this database hasn't recorded yet, once"""
+    migrations = (
+        # Rollups only count uploads made after their tables existed
+        ('backfill_rollups', backfill_rollups),
+        ('rehash_photos_dct', rehash_photos),
+    )
+    applied = set(db.session.scalars(select(DataMigration.name)))
+    for name, migrate in migrations:
+        if name not in applied:
+            migrate()
+            db.session.add(DataMigration(name=name))
+            db.session.commit()
+            app.logger.info('Applied data migration %s', name)
+
+
+@app.cli.command('backfill-stats')
+def backfill_stats_command():
+    print(f'Rebuilt {backfill_rollups()} rollup rows.')
+
+
+def backfill_hashes():
+    """Hash every stored photo that has no perceptual hash yet; returns how many were hashed"""
+    import cv2
+    from image_hash import phash as perceptual_hash
+
+    updated = 0
+    last_id = 0
+    while True:
+        photos = (Photo.query.filter(Photo.id > last_id, Photo.phash.is_(None))
+                  .order_by(Photo.id).limit(500).all())
+        if not photos:
+            break
+        for photo in photos:
+            image = cv2.imread(os.path.join(app.config['UPLOAD_FOLDER'], photo.filename))
+            phash = perceptual_hash(image) if image is not None else None
+            if phash is not None:
+                photo.set_phash(phash)
+                updated += 1
+        last_id = photos[-1].id
+        db.session.commit()
+    return updated
+
+
+def rehash_photos():
+    """Replace the old difference hashes with DCT hashes; the two can't be compared"""
+    db.session.execute(update(Photo).values(phash=None, phash_0=None, phash_1=None, phash_2=None, phash_3=None))
+    db.session.commit()
+    return backfill_hashes()
+
+
+@app.cli.command('backfill-hashes')
+def backfill_hashes_command():
+    """Compute perceptual hashes for photos uploaded before hashing existed"""
+    print(f'Hashed {backfill_hashes()} photos.')
+
+
+def remove_photo(photo):
+    """Delete a photo row with its comments and reactions, taking back its coins and rollup count"""
+    owner = db.session.get(User, photo.user_id)
+    if owner is not None:
+        owner.smile_coins = max((owner.smile_coins or 0) - (photo.smile_score or 0), 0)
+    bump_rollup(photo.user_id, photo.uploaded_at, photo.smile_score, -1)
+    db.session.execute(delete(Comment).where(Comment.photo_id == photo.id))
+    db.session.execute(delete(Reaction).where(Reaction.photo_id == photo.id))
+    db.session.delete(photo)
+
+
+@app.cli.command('sweep-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report invalid files.')
+@click.option('--delete-photos', is_flag=True, help='Delete the photos that used quarantined files instead of hiding them.')
+def sweep_uploads_command(dry_run, delete_photos):
+    """Move stored uploads that fail the header check into instance/quarantine.
+
+    Photos pointing at a quarantined file are made private so the community
+    page doesn't show a broken image, or deleted with --delete-photos.
+    """
+    upload_folder = app.config['UPLOAD_FOLDER']
+    quarantine = os.path.join(app.instance_path, 'quarantine')
+    swept = 0
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            try:
+                with open(entry.path, 'rb') as f:
+                    sniff_stream(f)
+                continue
+            except UploadRejected as rejection:
+                reason = rejection.code
+
+            photos = db.session.scalars(select(Photo).where(Photo.filename == entry.name)).all()
+            photo_ids = [photo.id for photo in photos]
+            print(f'{entry.name}: {reason}' + (f' (photo ids {photo_ids})' if photo_ids else ''))
+            if not dry_run:
+                os.makedirs(quarantine, exist_ok=True)
+                os.replace(entry.path, os.path.join(quarantine, entry.name))
+                for photo in photos:
+                    if delete_photos:
+                        remove_photo(photo)
+                    else:
+                        photo.public = False
+                db.session.commit()
+            swept += 1
+    action = 'Found' if dry_run else 'Quarantined'
+    print(f'{action} {swept} invalid file(s).')
+
+
 @app.cli.command('seed-db')
 def seed_db_command():
     rewards_data = [
@@ -386,5 +1044,5 @@ def seed_db_command():
 
 
 # ------------------ MAIN ------------------
-if __name__ == '_main_':
+if __name__ == '__main__':
     app.run(debug=True)
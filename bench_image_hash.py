@@ -0,0 +1,92 @@
+"""Latency of find_near_duplicate against a photo table with 1M hashed rows.
+
+Builds a throwaway SQLite database with the app's schema (no ANALYZE, like a
+freshly upgraded install) and times the same lookup the upload route runs.
+By default every photo belongs to one user, the worst case for the lookup.
+
+Usage: python bench_image_hash.py [num_photos] [num_queries] [num_users]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='smilesphere-bench-'), 'bench.db')
+os.environ['SMILESPHERE_DATABASE_URI'] = 'sqlite:///' + DB_PATH
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import app, db, User, Photo, find_near_duplicate  # noqa: E402
+from image_hash import to_signed, split_chunks  # noqa: E402
+
+BATCH = 50_000
+
+
+def percentile_ms(samples, q):
+    return np.percentile(np.array(samples) * 1000, q)
+
+
+def random_hash(rng):
+    return int(rng.integers(0, np.iinfo(np.uint64).max, dtype=np.uint64, endpoint=True))
+
+
+def fill(rng, n, users):
+    """Bulk-insert n photos with random hashes; returns the hashes"""
+    db.session.execute(insert(User), [
+        {'id': u, 'username': f'bench{u}', 'email': f'bench{u}@example.com'} for u in range(1, users + 1)
+    ])
+    hashes = rng.integers(0, np.iinfo(np.uint64).max, size=n, dtype=np.uint64, endpoint=True).tolist()
+    owners = rng.integers(1, users + 1, size=n).tolist()
+    for offset in range(0, n, BATCH):
+        rows = []
+        for value, user_id in zip(hashes[offset:offset + BATCH], owners[offset:offset + BATCH]):
+            c0, c1, c2, c3 = split_chunks(value)
+            rows.append({'filename': 'bench.jpg', 'user_id': user_id, 'phash': to_signed(value),
+                         'phash_0': c0, 'phash_1': c1, 'phash_2': c2, 'phash_3': c3})
+        db.session.execute(insert(Photo), rows)
+    db.session.commit()
+    return hashes, owners
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    max_distance = app.config['DUPLICATE_MAX_DISTANCE']
+    rng = np.random.default_rng(0)
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        hashes, owners = fill(rng, n, users)
+        print(f"Inserted {n:,} photos for {users} user(s) in {time.perf_counter() - start:.1f}s")
+
+        # Half the queries are near-duplicates of stored hashes, half are random
+        probes = []
+        for i, t in enumerate(rng.integers(0, n, size=queries).tolist()):
+            value = hashes[t]
+            if i % 2 == 0:
+                for bit in rng.choice(64, size=max_distance, replace=False).tolist():
+                    value ^= 1 << bit
+            else:
+                value = random_hash(rng)
+            probes.append((owners[t], value))
+
+        times, found = [], 0
+        for user_id, value in probes:
+            start = time.perf_counter()
+            found += find_near_duplicate(user_id, value, max_distance) is not None
+            times.append(time.perf_counter() - start)
+
+    print(f"find_near_duplicate (k={max_distance}): p50 {percentile_ms(times, 50):.3f} ms, "
+          f"p99 {percentile_ms(times, 99):.3f} ms, {found}/{queries} matched")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(os.path.dirname(DB_PATH), ignore_errors=True)
@@ -0,0 +1,88 @@
+"""Check that near-duplicate detection still catches crops and re-encodes.
+
+Every readable image in the upload folder (or the given directory) is cropped
+by 1%, 2% and 5% (from one corner, both sides, and each edge), and also
+halved and re-encoded as JPEG. Each variant is hashed and compared with the
+original at the app's DUPLICATE_MAX_DISTANCE. The script exits non-zero if
+the share of variants caught falls below the floors, or if two different
+images fall within the threshold.
+
+Usage: python check_duplicate_hash.py [image_dir]
+"""
+import itertools
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from image_hash import hamming, phash
+
+# Minimum share of variants that must be flagged as duplicates
+FLOORS = {
+    "reencode": 1.0,
+    "crop 1%": 0.95,
+    "crop 2%": 0.95,
+    "crop 5%": 0.80,
+}
+
+
+def crops(image, fraction):
+    h, w = image.shape[:2]
+    dy, dx = int(h * fraction), int(w * fraction)
+    yield image[dy:, dx:]
+    yield image[dy // 2:h - dy // 2, dx // 2:w - dx // 2]
+    yield image[:, dx:]
+    yield image[dy:, :]
+
+
+def reencode(image):
+    small = cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    _, encoded = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+
+def main():
+    from app import app
+
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else app.config["UPLOAD_FOLDER"]
+    max_distance = app.config["DUPLICATE_MAX_DISTANCE"]
+
+    hashes, images = {}, {}
+    for name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, name))
+        value = phash(image) if image is not None else None
+        if value is not None:
+            hashes[name], images[name] = value, image
+    if not hashes:
+        raise SystemExit(f"No hashable images in {image_dir}")
+
+    distances = {label: [] for label in FLOORS}
+    for name, image in images.items():
+        distances["reencode"].append(hamming(hashes[name], phash(reencode(image))))
+        for percent in (1, 2, 5):
+            for variant in crops(image, percent / 100):
+                distances[f"crop {percent}%"].append(hamming(hashes[name], phash(variant)))
+
+    failed = False
+    print(f"{len(hashes)} images, k={max_distance}")
+    for label, floor in FLOORS.items():
+        caught = float(np.mean(np.array(distances[label]) <= max_distance))
+        ok = caught >= floor
+        failed |= not ok
+        print(f"  {label:9} caught {caught:.0%} (floor {floor:.0%}){'' if ok else '  FAIL'}")
+
+    # Distinct pictures must stay apart; identical pixels are real duplicates
+    false_matches = [
+        (a, b) for a, b in itertools.combinations(hashes, 2)
+        if hamming(hashes[a], hashes[b]) <= max_distance
+        and not (images[a].shape == images[b].shape and np.array_equal(images[a], images[b]))
+    ]
+    for a, b in false_matches:
+        print(f"  false match: {a} ~ {b} ({hamming(hashes[a], hashes[b])} bits)  FAIL")
+    if failed or false_matches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Pre-fork production server: gunicorn -c gunicorn.conf.py "serve:create_app()"
+import multiprocessing
+import os
+
+bind = os.environ.get("SMILESPHERE_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("SMILESPHERE_WORKERS", multiprocessing.cpu_count()))
+
+# Sync workers serve one request each, so rate limits and the scoring caps only
+# mean anything when every worker shares them (read when the app is preloaded)
+os.environ.setdefault("SMILESPHERE_ADMISSION_BACKEND", "sqlite")
+
+# Load the app (and the smile detector model) in the master before forking
+preload_app = True
+
+# Recycle workers gracefully so slow leaks in OpenCV can't accumulate;
+# jitter keeps them from all restarting at once
+max_requests = int(os.environ.get("SMILESPHERE_MAX_REQUESTS", 1000))
+max_requests_jitter = 100
+graceful_timeout = 30
+timeout = 60
+
+
+def on_starting(server):
+    backend = server.app.callable.config["ADMISSION_BACKEND"]
+    if backend == "local" and server.cfg.workers > 1:
+        raise RuntimeError("SMILESPHERE_ADMISSION_BACKEND=local keeps separate limits in each of the "
+                           f"{server.cfg.workers} workers; use sqlite or run a single worker")
+
+
+def when_ready(server):
+    from serve import memory_usage
+
+    rss, pss, _ = memory_usage()
+    cold_start = server.app.callable.config.get("COLD_START_SECONDS")
+    server.log.info("Master ready: cold start %.2fs, rss %s kB, pss %s kB", cold_start or 0, rss, pss)
+
+
+def post_fork(server, worker):
+    # One OpenCV thread per worker; the pre-fork workers already use every core
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def post_worker_init(worker):
+    from serve import memory_usage
+
+    rss, pss, private = memory_usage()
+    worker.log.info("Worker %s ready: rss %s kB, pss %s kB, private %s kB", worker.pid, rss, pss, private)
@@ -0,0 +1,92 @@
+from itertools import combinations
+
+import numpy as np
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def _area_resize(gray, rows, cols):
+    """Area-average a 2D array down to rows x cols"""
+    h, w = gray.shape
+    row_edges = np.linspace(0, h, rows + 1).astype(int)[:-1]
+    col_edges = np.linspace(0, w, cols + 1).astype(int)[:-1]
+    small = np.add.reduceat(np.add.reduceat(gray, row_edges, axis=0), col_edges, axis=1)
+    return small / np.outer(np.diff(np.append(row_edges, h)), np.diff(np.append(col_edges, w)))
+
+
+def _dct_matrix(n, keep):
+    """First `keep` rows of the orthonormal DCT-II matrix of size n"""
+    k = np.arange(keep)[:, None]
+    x = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+
+DCT_SIZE = 32
+_DCT = _dct_matrix(DCT_SIZE, 8)
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a decoded BGR (or grayscale) image, or None if too small or blank.
+
+    Each bit says whether one of the 8x8 lowest frequencies of a 32x32
+    thumbnail is above their median. Low frequencies move little when a few
+    percent is cropped off an edge, unlike the gradients a difference hash uses.
+    """
+    image = np.asarray(image)
+    if image.ndim == 3:
+        gray = image[..., :3].astype(np.float32) @ np.array([0.114, 0.587, 0.299], dtype=np.float32)
+    else:
+        gray = image.astype(np.float32)
+
+    if gray.shape[0] < DCT_SIZE or gray.shape[1] < DCT_SIZE:
+        return None
+
+    low = _DCT @ _area_resize(gray, DCT_SIZE, DCT_SIZE).astype(np.float32) @ _DCT.T
+    low = low.ravel()
+    if np.abs(low[1:]).max() < 8.0:
+        # A blank frame (under about one grey level of detail); its bits would be noise
+        return None
+    # The DC term is just overall brightness; leave it out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def to_signed(value):
+    """Store an unsigned 64-bit hash in a signed 64-bit integer column"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & ((1 << HASH_BITS) - 1)
+
+
+def hamming(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def split_chunks(value):
+    """Split a hash into CHUNKS integers of CHUNK_BITS bits, most significant first"""
+    value = to_unsigned(value)
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def chunk_probes(chunk, radius):
+    """All chunk values within `radius` bit flips of `chunk`"""
+    probes = [chunk]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for p in positions:
+                flipped ^= 1 << p
+            probes.append(flipped)
+    return probes
+
+
+def probe_radius(max_distance):
+    """Pigeonhole: two hashes within max_distance differ by at most this in some chunk"""
+    return max_distance // CHUNKS
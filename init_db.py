@@ -1,14 +1,35 @@
 import os
 import sys
 import random
+import struct
+import zlib
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash
-from app import app, db, User, Photo, Comment, Reaction, Reward, Redemption
+from app import app, db, upgrade_schema, backfill_rollups, User, Photo, Comment, Reaction, Reward, Redemption
+
+def sample_png(seed, size=96):
+    """A small real PNG (a random 8x8 colour grid) that passes upload validation"""
+    rng = random.Random(seed)
+    cells = [[bytes(rng.randrange(256) for _ in range(3)) for _ in range(8)] for _ in range(8)]
+    scale = size // 8
+    rows = b"".join(
+        b"\x00" + b"".join(cells[y // scale][x // scale] for x in range(size))
+        for y in range(size)
+    )
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows))
+            + chunk(b"IEND", b""))
 
 def init_db():
     """Initialize the database with tables"""
     with app.app_context():
         db.create_all()
+        upgrade_schema()
         print("Database tables created.")
 
 def add_sample_data():
@@ -45,26 +66,24 @@ def add_sample_data():
         print(f"Added {len(users)} sample users.")
         
         # Create sample photos
-        # Note: In a real scenario, you would have actual image files
-        # For this sample, we'll just create the database entries
         
         # Create uploads directory if it doesn't exist
         uploads_dir = os.path.join(app.static_folder, 'images', 'uploads')
         os.makedirs(uploads_dir, exist_ok=True)
         
-        # Sample photo filenames (these would be actual files in a real scenario)
+        # Sample photo filenames
         sample_filenames = [
-            "user1_smile1.jpg", "user1_smile2.jpg", 
-            "user2_smile1.jpg", "user3_smile1.jpg", 
-            "user4_smile1.jpg", "user5_smile1.jpg"
+            "user1_smile1.png", "user1_smile2.png", 
+            "user2_smile1.png", "user3_smile1.png", 
+            "user4_smile1.png", "user5_smile1.png"
         ]
         
-        # Create empty placeholder files
-        for filename in sample_filenames:
+        # Write small generated images so the files are real PNGs
+        for seed, filename in enumerate(sample_filenames):
             file_path = os.path.join(uploads_dir, filename)
             if not os.path.exists(file_path):
-                with open(file_path, 'w') as f:
-                    f.write("Placeholder for sample image")
+                with open(file_path, 'wb') as f:
+                    f.write(sample_png(seed))
         
         # Create photo records
         photos = []
@@ -73,7 +92,7 @@ def add_sample_data():
         # Admin photos
         photos.append(Photo(
             user_id=1, 
-            filename="user1_smile1.jpg", 
+            filename="user1_smile1.png", 
             smile_score=9, 
             public=True, 
             uploaded_at=now - timedelta(days=5)
@@ -81,7 +100,7 @@ def add_sample_data():
         
         photos.append(Photo(
             user_id=1, 
-            filename="user1_smile2.jpg", 
+            filename="user1_smile2.png", 
             smile_score=7, 
             public=True, 
             uploaded_at=now - timedelta(days=2)
@@ -90,7 +109,7 @@ def add_sample_data():
         # John's photo
         photos.append(Photo(
             user_id=2, 
-            filename="user2_smile1.jpg", 
+            filename="user2_smile1.png", 
             smile_score=8, 
             public=True, 
             uploaded_at=now - timedelta(days=3)
@@ -99,7 +118,7 @@ def add_sample_data():
         # Sarah's photo
         photos.append(Photo(
             user_id=3, 
-            filename="user3_smile1.jpg", 
+            filename="user3_smile1.png", 
             smile_score=10, 
             public=True, 
             uploaded_at=now - timedelta(days=1)
@@ -108,7 +127,7 @@ def add_sample_data():
         # Mike's photo
         photos.append(Photo(
             user_id=4, 
-            filename="user4_smile1.jpg", 
+            filename="user4_smile1.png", 
             smile_score=6, 
             public=False,  # Private photo
             uploaded_at=now - timedelta(days=4)
@@ -117,7 +136,7 @@ def add_sample_data():
         # Emma's photo
         photos.append(Photo(
             user_id=5, 
-            filename="user5_smile1.jpg", 
+            filename="user5_smile1.png", 
             smile_score=7, 
             public=True, 
             uploaded_at=now - timedelta(hours=12)
@@ -127,6 +146,7 @@ def add_sample_data():
             db.session.add(photo)
         
         db.session.commit()
+        backfill_rollups()
         print(f"Added {len(photos)} sample photos.")
         
         # Add sample comments
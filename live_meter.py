@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class LiveSmileSession:
+    """Per-client state for the live smile meter, kept in a session store between frames"""
+
+    def __init__(self, redetect_every=5, score_smoothing=0.35, box_smoothing=0.5, state=None):
+        self.redetect_every = redetect_every
+        self.score_smoothing = score_smoothing
+        self.box_smoothing = box_smoothing
+
+        state = state or {}
+        self.faces = [tuple(face) for face in state.get("faces", [])]
+        self.frames_since_detect = state.get("frames_since_detect", redetect_every)
+        self.smoothed_score = state.get("smoothed_score", 0.0)
+
+        self.frames = state.get("frames", 0)
+        self.skipped = state.get("skipped", 0)
+        self.dnn_runs = state.get("dnn_runs", 0)
+        self.started = state.get("started")
+        self.last_frame = state.get("last_frame")
+        # Wall time x OpenCV threads: cv2.dnn runs on its own pool, so the request
+        # thread's CPU time undercounts the cores a frame really uses
+        self.core_seconds = state.get("core_seconds", 0.0)
+
+    def state(self):
+        return {
+            "faces": [list(face) for face in self.faces],
+            "frames_since_detect": self.frames_since_detect,
+            "smoothed_score": self.smoothed_score,
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "dnn_runs": self.dnn_runs,
+            "started": self.started,
+            "last_frame": self.last_frame,
+            "core_seconds": self.core_seconds,
+        }
+
+    def _smooth_faces(self, new_faces):
+        """Blend freshly detected boxes with the tracked ones to reduce jitter"""
+        if len(new_faces) != len(self.faces) or not self.faces:
+            return list(new_faces)
+        a = self.box_smoothing
+        return [
+            tuple(int(a * n + (1 - a) * o) for n, o in zip(new, old))
+            for new, old in zip(new_faces, self.faces)
+        ]
+
+    def process(self, detector, frame_bytes):
+        """Score one frame and fold it into the tracked state"""
+        start = time.perf_counter()
+        if self.started is None:
+            self.started = time.time()
+        image = detector.load_image(frame_bytes)
+        if image is None:
+            return {"score": 0, "message": "Invalid frame"}
+
+        # Only run the DNN every few frames, reusing the tracked boxes in between
+        if not self.faces or self.frames_since_detect >= self.redetect_every:
+            self.faces = self._smooth_faces(detector.detect_faces(image))
+            self.frames_since_detect = 0
+            self.dnn_runs += 1
+        else:
+            self.frames_since_detect += 1
+
+        score, message = detector.score_image(image, self.faces)
+        if score == 0:
+            # Lost the face, force a fresh detection on the next frame
+            self.faces = []
+
+        a = self.score_smoothing
+        self.smoothed_score = a * score + (1 - a) * self.smoothed_score
+
+        self.core_seconds += (time.perf_counter() - start) * getattr(detector, "num_threads", 1)
+        self.frames += 1
+        self.last_frame = time.time()
+        return {"score": score, "message": message}
+
+    def wall_seconds(self):
+        if self.started is None or self.last_frame is None:
+            return 0.0
+        return self.last_frame - self.started
+
+    def stats(self):
+        wall = self.wall_seconds()
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "dnn_runs": self.dnn_runs,
+            "fps": round(self.frames / wall, 1) if wall else 0.0,
+            "fps_per_core": round(self.frames / self.core_seconds, 1) if self.core_seconds else 0.0,
+        }
+
+
+class LocalSessionStore:
+    """Session state in this process only; fine for the dev server or a single worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # key -> [state, busy_until, last_seen]
+
+    def claim(self, key, now, lease, idle_timeout):
+        """Return (True, state) and mark the session busy, or (False, state) if a frame is in flight"""
+        with self._lock:
+            for stale in [k for k, (_, _, seen) in self._sessions.items() if now - seen > idle_timeout]:
+                del self._sessions[stale]
+            entry = self._sessions.setdefault(key, [{}, 0.0, now])
+            entry[2] = now
+            if entry[1] > now:
+                entry[0]["skipped"] = entry[0].get("skipped", 0) + 1
+                return False, dict(entry[0])
+            entry[1] = now + lease
+            return True, dict(entry[0])
+
+    def release(self, key, state):
+        """Save the session and clear its busy mark, keeping frames skipped in the meantime"""
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is not None:
+                entry[:2] = [{**state, "skipped": entry[0].get("skipped", 0)}, 0.0]
+
+    def end(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def states(self, now, idle_timeout):
+        with self._lock:
+            return [dict(state) for state, _, seen in self._sessions.values() if now - seen <= idle_timeout]
+
+
+class SQLiteSessionStore:
+    """Session state in a small SQLite file, so every worker on a host sees the same session"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS live_sessions "
+        "(key TEXT PRIMARY KEY, state TEXT, busy_until REAL, last_seen REAL)",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # Connections must not cross a fork or be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def claim(self, key, now, lease, idle_timeout):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM live_sessions WHERE last_seen < ?", (now - idle_timeout,))
+            row = conn.execute("SELECT state, busy_until FROM live_sessions WHERE key = ?", (key,)).fetchone()
+            state, busy_until = (json.loads(row[0]), row[1]) if row else ({}, 0.0)
+            claimed = busy_until <= now
+            if claimed:
+                busy_until = now + lease
+            else:
+                state["skipped"] = state.get("skipped", 0) + 1
+            conn.execute("INSERT OR REPLACE INTO live_sessions (key, state, busy_until, last_seen) "
+                         "VALUES (?, ?, ?, ?)", (key, json.dumps(state), busy_until, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed, state
+
+    def release(self, key, state):
+        self._conn().execute(
+            "UPDATE live_sessions SET busy_until = 0, "
+            "state = json_set(?, '$.skipped', coalesce(json_extract(state, '$.skipped'), 0)) WHERE key = ?",
+            (json.dumps(state), key))
+
+    def end(self, key):
+        self._conn().execute("DELETE FROM live_sessions WHERE key = ?", (key,))
+
+    def states(self, now, idle_timeout):
+        rows = self._conn().execute("SELECT state FROM live_sessions WHERE last_seen >= ?",
+                                    (now - idle_timeout,)).fetchall()
+        return [json.loads(state) for (state,) in rows]
+
+
+class LiveMeter:
+    """Live sessions keyed by user, held in a store so any worker can score the next frame"""
+
+    def __init__(self, store=None, idle_timeout=60, busy_lease=10):
+        self.store = store or LocalSessionStore()
+        self.idle_timeout = idle_timeout
+        # A worker that dies mid-frame never releases its session; the claim expires instead
+        self.busy_lease = busy_lease
+
+    def process(self, key, detector, frame_bytes):
+        """Score one frame for `key`; returns (result, session), with result None if the frame was skipped.
+
+        Only one frame per client is scored at a time, whichever worker gets
+        it; frames arriving meanwhile are dropped.
+        """
+        claimed, state = self.store.claim(str(key), time.time(), self.busy_lease, self.idle_timeout)
+        session = LiveSmileSession(state=state)
+        if not claimed:
+            return None, session
+        try:
+            return session.process(detector, frame_bytes), session
+        finally:
+            self.store.release(str(key), session.state())
+
+    def end(self, key):
+        self.store.end(str(key))
+
+    def stats(self):
+        """Sustained frames per second (wall clock), and per core, across all active sessions"""
+        sessions = [LiveSmileSession(state=state) for state in self.store.states(time.time(), self.idle_timeout)]
+        frames = sum(s.frames for s in sessions)
+        fps = sum((s.frames / s.wall_seconds() for s in sessions if s.wall_seconds()), 0.0)
+        cores = sum(s.core_seconds for s in sessions)
+        return {
+            "sessions": len(sessions),
+            "frames": frames,
+            "fps": round(fps, 1),
+            "fps_per_core": round(frames / cores, 1) if cores else 0.0,
+        }
@@ -41,10 +41,23 @@ if [ ! -f "instance/smilesphere.db" ]; then
         echo "Error: Failed to initialize database."
         exit 1
     fi
+else
+    # Add any tables, columns and indexes that newer versions expect
+    echo "Upgrading database schema..."
+    flask --app app init-db
+    if [ $? -ne 0 ]; then
+        echo "Error: Failed to upgrade database."
+        exit 1
+    fi
 fi
 
 # Run the application
+if [ "$1" == "--prod" ]; then
+    echo "Starting SmileSphere with gunicorn (pre-fork, shared model)..."
+    exec gunicorn -c gunicorn.conf.py "serve:create_app()"
+fi
+
 echo "Starting SmileSphere application..."
 echo "Open your browser and navigate to http://127.0.0.1:5000"
 echo "Press Ctrl+C to stop the server"
-python app.py
\ No newline at end of file
+python app.py
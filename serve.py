@@ -0,0 +1,57 @@
+import gc
+import logging
+import os
+import time
+
+logger = logging.getLogger("smilesphere.serve")
+
+
+def memory_usage():
+    """Return (rss_kb, pss_kb, private_kb) for this process, or None where unavailable"""
+    rss = pss = private = None
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                kb = int(value.split()[0])
+                if key == "Rss":
+                    rss = kb
+                elif key == "Pss":
+                    pss = kb
+                elif key in ("Private_Clean", "Private_Dirty"):
+                    private = (private or 0) + kb
+    except (OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss, pss, private
+
+
+def create_app():
+    """Build the app for a pre-fork server, loading OpenCV and the face model up front.
+
+    Run with ``preload_app`` so this happens once in the master and the model
+    memory is shared copy-on-write by every forked worker.
+    """
+    start = time.perf_counter()
+
+    import cv2  # noqa: F401  (import before fork so the library pages are shared)
+    from app import app, db, upgrade_schema
+    from smile_detector import get_detector
+
+    # Bring an older database up to the current schema before any worker queries it
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+
+    get_detector()
+
+    # Move everything loaded so far out of the GC's reach so collections in the
+    # workers don't touch (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+
+    cold_start = time.perf_counter() - start
+    rss, _, _ = memory_usage()
+    app.config["COLD_START_SECONDS"] = cold_start
+    logger.info("App and smile detector loaded in %.2fs (pid %s, rss %s kB)", cold_start, os.getpid(), rss)
+    return app
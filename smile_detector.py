@@ -3,15 +3,75 @@ import os
 import logging
 import cv2
 import numpy as np
+import json
+import threading
 import urllib.request
 
+from image_hash import phash as perceptual_hash
+
+# Used when no tuned config is present; see tune_detector.py
+DEFAULT_CONFIG = {
+    "face_confidence": 0.6,
+    "smile_scale_factor": 1.8,
+    "smile_min_neighbors": 25,
+    "smile_min_size": 30,
+}
+CONFIG_PATH = os.environ.get(
+    "SMILE_DETECTOR_CONFIG",
+    os.path.join(os.path.dirname(__file__), "models", "detector_config.json")
+)
+# Input preprocessing for the SSD face detector
+DNN_INPUT_SIZE = (300, 300)
+DNN_SCALE = 1.0
+DNN_MEAN = (104.0, 177.0, 123.0)
+
+
+def load_config(path=CONFIG_PATH):
+    """Defaults overlaid with whatever known keys the config file provides"""
+    config = dict(DEFAULT_CONFIG)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        config.update({key: saved[key] for key in DEFAULT_CONFIG if key in saved})
+    return config
+
+
+def faces_from_detections(detections, width, height, confidence):
+    """Face boxes (x, y, w, h) from raw SSD output above a confidence threshold"""
+    faces = []
+    for i in range(0, detections.shape[2]):
+        if detections[0, 0, i, 2] > confidence:  # Only accept strong detections
+            box = detections[0, 0, i, 3:7] * np.array([width, height, width, height])
+            (x1, y1, x2, y2) = box.astype("int")
+            faces.append((x1, y1, x2 - x1, y2 - y1))
+    return faces
+
+
+def smile_in_faces(cascade, gray, faces, config):
+    """Return True if the smile cascade fires inside any of the face boxes"""
+    min_size = int(config["smile_min_size"])
+    for (x, y, w, h) in faces:
+        roi_gray = gray[max(y, 0):y+h, max(x, 0):x+w]
+        if roi_gray.size == 0:
+            continue
+        smiles = cascade.detectMultiScale(
+            roi_gray,
+            scaleFactor=config["smile_scale_factor"],
+            minNeighbors=int(config["smile_min_neighbors"]),
+            minSize=(min_size, min_size)
+        )
+        if len(smiles) > 0:
+            return True
+    return False
+
 
 class SmileDetector:
     """Smile detection with deep learning face detection"""
 
-    def __init__(self):   # <-- FIXED
+    def __init__(self, config=None):
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        self.config = dict(config) if config is not None else load_config()
 
         # Create models directory if not exists
         self.model_dir = os.path.join(os.path.dirname(__file__), "models")
@@ -24,8 +84,9 @@ class SmileDetector:
         # Download models if not already present
         self._download_models()
 
-        # Load DNN face detector
+        # Load DNN face detector (a cv2.dnn.Net is not safe to share across threads)
         self.face_net = cv2.dnn.readNetFromCaffe(self.configFile, self.modelFile)
+        self._net_lock = threading.Lock()
 
         # Haar cascade for smiles only
         haar_path = cv2.data.haarcascades
@@ -47,63 +108,77 @@ class SmileDetector:
                 self.modelFile
             )
 
+    @property
+    def num_threads(self):
+        """Threads OpenCV may use for one inference (1 under the pre-fork server)"""
+        return max(cv2.getNumThreads(), 1)
+
+    def face_detections(self, image):
+        """Raw SSD output for an image (independent of the confidence threshold)"""
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, DNN_INPUT_SIZE), DNN_SCALE,
+                                     DNN_INPUT_SIZE, DNN_MEAN)
+        with self._net_lock:
+            self.face_net.setInput(blob)
+            return self.face_net.forward()
+
     def detect_faces(self, image):
         """Detect faces using OpenCV DNN"""
         (h, w) = image.shape[:2]
-        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0,
-                                     (300, 300), (104.0, 177.0, 123.0))
-        self.face_net.setInput(blob)
-        detections = self.face_net.forward()
-
-        faces = []
-        for i in range(0, detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
-            if confidence > 0.6:  # Only accept strong detections
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                (x1, y1, x2, y2) = box.astype("int")
-                faces.append((x1, y1, x2 - x1, y2 - y1))
-        return faces
+        return faces_from_detections(self.face_detections(image), w, h, self.config["face_confidence"])
+
+    def load_image(self, image_data):
+        """Decode a file path or raw bytes into a BGR image (None if unreadable)"""
+        if isinstance(image_data, np.ndarray):
+            return image_data
+        if isinstance(image_data, str) and os.path.exists(image_data):
+            return cv2.imread(image_data)
+        if isinstance(image_data, bytes):
+            return cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        raise TypeError("Unsupported image data type")
+
+    def detect_smile(self, image, faces):
+        """Return True if the smile cascade fires inside any of the face boxes"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return smile_in_faces(self.smile_cascade, gray, faces, self.config)
+
+    def score_image(self, image, faces=None):
+        """Score an already-decoded image, optionally reusing known face boxes"""
+        if faces is None:
+            faces = self.detect_faces(image)
+        if len(faces) == 0:
+            return 0, "No human face detected"
+
+        if self.detect_smile(image, faces):
+            return random.randint(7, 10), "Smile detected"
+
+        return random.randint(1, 3), "Face detected, no strong smile"
 
     def calculate_smile_score(self, image_data):
         """Detect smile and return score"""
         try:
-            # Load image
-            if isinstance(image_data, str) and os.path.exists(image_data):
-                image = cv2.imread(image_data)
-            elif isinstance(image_data, bytes):
-                image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
-            else:
-                return 0, "Unsupported image data type"
+            try:
+                image = self.load_image(image_data)
+            except TypeError as e:
+                return 0, str(e)
 
             if image is None:
                 return 0, "Invalid image file"
 
-            # Detect faces
-            faces = self.detect_faces(image)
-            if len(faces) == 0:
-                return 0, "No human face detected"
-
-            # Check smiles in detected faces
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            for (x, y, w, h) in faces:
-                roi_gray = gray[y:y+h, x:x+w]
-                smiles = self.smile_cascade.detectMultiScale(
-                    roi_gray,
-                    scaleFactor=1.8,
-                    minNeighbors=25,
-                    minSize=(30, 30)
-                )
-                if len(smiles) > 0:
-                    return random.randint(7, 10), "Smile detected"
-
-            return random.randint(1, 3), "Face detected, no strong smile"
+            return self.score_image(image)
 
         except Exception as e:
             self.logger.error(f"Error in smile detection: {str(e)}")
             return 0, f"Error: {str(e)}"
 
     def analyze_image(self, image_path_or_data):
-        score, message = self.calculate_smile_score(image_path_or_data)
+        # Decode once and reuse the pixels for both the hash and the score
+        try:
+            image = self.load_image(image_path_or_data)
+        except TypeError:
+            image = None
+        phash = perceptual_hash(image) if image is not None else None
+
+        score, message = self.calculate_smile_score(image if image is not None else image_path_or_data)
 
         if score == 0:
             feedback = message
@@ -119,10 +194,25 @@ class SmileDetector:
         return {
             "score": score,
             "message": message,
-            "feedback": feedback
+            "feedback": feedback,
+            "phash": phash
         }
 
 
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """Return the process-wide SmileDetector, loading the models on first use"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = SmileDetector()
+    return _detector
+
+
 if __name__ == "__main__":   # <-- FIXED
     detector = SmileDetector()
     import sys
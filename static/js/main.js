@@ -269,4 +269,49 @@ document.addEventListener('DOMContentLoaded', function() {
         passwordInput.addEventListener('change', validatePasswordMatch);
         passwordConfirmInput.addEventListener('keyup', validatePasswordMatch);
     }
-});
\ No newline at end of file
+
+    // "Load more" buttons: fetch the next page fragment and append it to the target.
+    // The server sends the following page's URL in X-Next-Url; no header means we're done.
+    document.querySelectorAll('[data-load-more]').forEach(function(button) {
+        const target = document.querySelector(button.dataset.target);
+        let loading = false;
+
+        function loadMore() {
+            if (loading || !button.dataset.url) {
+                return;
+            }
+            loading = true;
+            button.disabled = true;
+            fetch(button.dataset.url)
+                .then(response => {
+                    const nextUrl = response.headers.get('X-Next-Url');
+                    return response.text().then(html => ({ html, nextUrl }));
+                })
+                .then(({ html, nextUrl }) => {
+                    target.insertAdjacentHTML('beforeend', html);
+                    if (nextUrl) {
+                        button.dataset.url = nextUrl;
+                    } else {
+                        delete button.dataset.url;
+                        button.parentElement.classList.add('d-none');
+                    }
+                })
+                .catch(error => console.error('Error loading more:', error))
+                .finally(() => {
+                    loading = false;
+                    button.disabled = false;
+                });
+        }
+
+        button.addEventListener('click', loadMore);
+
+        // Load the next page automatically as the button scrolls into view
+        if ('IntersectionObserver' in window) {
+            new IntersectionObserver(function(entries) {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadMore();
+                }
+            }, { rootMargin: '200px' }).observe(button);
+        }
+    });
+});
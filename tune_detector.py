@@ -0,0 +1,206 @@
+"""Sweep SmileDetector thresholds over a labeled image set.
+
+The labels file is a CSV of ``path,label`` rows (label 1 = smiling, 0 = not).
+Relative paths are resolved against the CSV's directory. Every image is
+decoded and run through the face DNN once; the raw DNN output is cached on
+disk so later runs skip it too. Worker processes then evaluate the parameter
+grid against those shared images. The script prints precision, recall and
+per-image latency for each setting, marks the Pareto frontier, and writes the
+best frontier setting (by F1) as a config that SmileDetector loads at startup.
+
+Usage: python tune_detector.py labels.csv [--workers N] [--grid grid.json]
+                               [--output models/detector_config.json] [--report report.csv]
+"""
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+import multiprocessing
+
+import cv2
+import numpy as np
+
+from smile_detector import (CONFIG_PATH, DEFAULT_CONFIG, DNN_INPUT_SIZE, DNN_MEAN, DNN_SCALE, SmileDetector,
+                            faces_from_detections, smile_in_faces)
+
+DEFAULT_GRID = {
+    "face_confidence": [0.4, 0.5, 0.6, 0.7, 0.8],
+    "smile_scale_factor": [1.1, 1.3, 1.5, 1.8],
+    "smile_min_neighbors": [10, 15, 20, 25, 35],
+    "smile_min_size": [20, 30, 40],
+}
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "models", "tuning_cache")
+
+# Set in the parent before the pool starts. Forked workers inherit it copy-on-write;
+# under spawn (Windows, macOS) each worker gets its own pickled copy instead.
+_samples = []
+_cascade = None
+
+
+def read_labels(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#") or row[0] == "path":
+                continue
+            yield os.path.join(base, row[0]), row[1].strip().lower() in ("1", "smile", "yes", "true")
+
+
+def model_fingerprint(detector):
+    """Identifies the face model files, OpenCV version and blob settings behind a cached output"""
+    parts = [cv2.__version__, f"{DNN_INPUT_SIZE}:{DNN_SCALE}:{DNN_MEAN}"]
+    for path in (detector.configFile, detector.modelFile):
+        stat = os.stat(path)
+        parts.append(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def cached_detections(detector, image_path, image, fingerprint):
+    """Raw DNN output for an image, cached on disk by path, size, mtime and model fingerprint"""
+    stat = os.stat(image_path)
+    key = hashlib.sha1(
+        f"{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}|{fingerprint}".encode()
+    ).hexdigest()
+    cache_file = os.path.join(CACHE_DIR, key + ".npz")
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return cached["detections"], float(cached["seconds"])
+
+    start = time.perf_counter()
+    detections = detector.face_detections(image)
+    seconds = time.perf_counter() - start
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    np.savez(cache_file, detections=detections, seconds=seconds)
+    return detections, seconds
+
+
+def load_samples(labels_path):
+    """Decode every image once and attach its (cached) DNN output"""
+    detector = SmileDetector(config=DEFAULT_CONFIG)
+    fingerprint = model_fingerprint(detector)
+    samples = []
+    for image_path, label in read_labels(labels_path):
+        image = cv2.imread(image_path)
+        if image is None:
+            print(f"Skipping unreadable image {image_path}")
+            continue
+        detections, dnn_seconds = cached_detections(detector, image_path, image, fingerprint)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        samples.append((gray, detections, dnn_seconds, label))
+    return samples
+
+
+def _init_worker(samples):
+    global _samples, _cascade
+    if samples is not None:
+        _samples = samples
+    _cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_smile.xml"))
+    cv2.setNumThreads(1)
+
+
+def evaluate(config):
+    """Confusion counts and per-image latency for one parameter setting"""
+    tp = fp = fn = tn = 0
+    latencies = []
+    for gray, detections, dnn_seconds, label in _samples:
+        start = time.perf_counter()
+        h, w = gray.shape
+        faces = faces_from_detections(detections, w, h, config["face_confidence"])
+        predicted = bool(faces) and smile_in_faces(_cascade, gray, faces, config)
+        latencies.append(dnn_seconds + time.perf_counter() - start)
+
+        if predicted and label:
+            tp += 1
+        elif predicted:
+            fp += 1
+        elif label:
+            fn += 1
+        else:
+            tn += 1
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        **config,
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+        "latency_ms": round(1000 * float(np.mean(latencies)), 3),
+        "latency_p95_ms": round(1000 * float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def pareto_frontier(results):
+    """Settings not beaten on precision, recall and latency all at once"""
+    def dominates(a, b):
+        no_worse = (a["precision"] >= b["precision"] and a["recall"] >= b["recall"]
+                    and a["latency_ms"] <= b["latency_ms"])
+        better = (a["precision"] > b["precision"] or a["recall"] > b["recall"]
+                  or a["latency_ms"] < b["latency_ms"])
+        return no_worse and better
+
+    return [r for r in results if not any(dominates(other, r) for other in results)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("labels", help="CSV of path,label rows")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--grid", help="JSON file mapping parameter names to lists of values")
+    parser.add_argument("--output", default=CONFIG_PATH, help="where to write the chosen config")
+    parser.add_argument("--report", help="optional CSV with every setting's results")
+    args = parser.parse_args()
+
+    grid = dict(DEFAULT_GRID)
+    if args.grid:
+        with open(args.grid) as f:
+            grid.update(json.load(f))
+
+    start = time.perf_counter()
+    samples = load_samples(args.labels)
+    if not samples:
+        raise SystemExit("No readable images in the labels file.")
+    print(f"Loaded {len(samples)} images in {time.perf_counter() - start:.1f}s")
+
+    names = list(DEFAULT_CONFIG)
+    configs = [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+    global _samples
+    _samples = samples
+    # Only send the images to workers that don't inherit the parent's memory
+    inherited = multiprocessing.get_start_method() == "fork"
+
+    start = time.perf_counter()
+    initargs = (None if inherited else samples,)
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=initargs) as pool:
+        results = pool.map(evaluate, configs, chunksize=max(1, len(configs) // (4 * args.workers)))
+    print(f"Evaluated {len(configs)} settings in {time.perf_counter() - start:.1f}s")
+
+    frontier = sorted(pareto_frontier(results), key=lambda r: r["latency_ms"])
+    columns = names + ["precision", "recall", "f1", "latency_ms", "latency_p95_ms"]
+    print("\nPareto frontier:")
+    print("  ".join(columns))
+    for r in frontier:
+        print("  ".join(str(r[c]) for c in columns))
+
+    if args.report:
+        with open(args.report, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns + ["pareto"])
+            writer.writeheader()
+            for r in results:
+                writer.writerow({**{c: r[c] for c in columns}, "pareto": r in frontier})
+
+    best = max(frontier, key=lambda r: (r["f1"], -r["latency_ms"]))
+    chosen = {name: best[name] for name in names}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(chosen, f, indent=2)
+    print(f"\nWrote {chosen} (f1 {best['f1']}, {best['latency_ms']} ms/image) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import base64
+import io
+import struct
+from collections import namedtuple
+
+# Read size while looking for the header; one read covers most files
+HEADER_BYTES = 64 * 1024
+# JPEG metadata (EXIF thumbnails, XMP, ICC profiles) is skipped by length up to here
+MAX_HEADER_SCAN = 2 * 1024 * 1024
+MAX_PIXELS = 40_000_000  # about 160MB once decoded to BGR
+MAX_SIDE = 16384
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SOI = b'\xff\xd8'
+# Start-of-frame markers carry the dimensions (C4, C8 and CC are not frames)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+ImageInfo = namedtuple('ImageInfo', 'format width height extension')
+
+
+class UploadRejected(Exception):
+    """An upload refused from its header alone; `code` is machine readable"""
+
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+    def to_dict(self):
+        return {'error': self.code, 'message': self.message}
+
+
+class _HeadReader:
+    """Buffers the start of a stream, reading more only when a parser asks for it"""
+
+    def __init__(self, stream, limit=MAX_HEADER_SCAN):
+        self.stream = stream
+        self.limit = limit
+        self.data = b''
+        self.eof = False
+
+    def has(self, end):
+        """True once the first `end` bytes are buffered, False if the file is shorter"""
+        while len(self.data) < end and not self.eof:
+            if end > self.limit:
+                raise UploadRejected(
+                    'header_too_large',
+                    "This image's metadata is too large. Please export it without embedded metadata.",
+                    status=413,
+                )
+            chunk = self.stream.read(max(HEADER_BYTES, end - len(self.data)))
+            if not chunk:
+                self.eof = True
+            self.data += chunk
+        return len(self.data) >= end
+
+
+class Base64Stream:
+    """Read-only stream over base64 text that decodes only as much as is read"""
+
+    def __init__(self, text):
+        self._text = text
+        self._pos = 0
+
+    def read(self, size=-1):
+        # Whole 4-character groups, so this may return up to two extra bytes
+        end = len(self._text) if size is None or size < 0 else self._pos + -(-size // 3) * 4
+        chars = self._text[self._pos:end]
+        self._pos += len(chars)
+        return base64.b64decode(chars)
+
+
+def _png_info(reader):
+    # Signature, then the IHDR chunk: length, type, width, height
+    if not reader.has(24) or reader.data[12:16] != b'IHDR':
+        raise UploadRejected('corrupt_header', 'This PNG file looks damaged.')
+    width, height = struct.unpack('>II', reader.data[16:24])
+    return ImageInfo('png', width, height, 'png')
+
+
+def _jpeg_info(reader):
+    pos = 2
+    while reader.has(pos + 4):
+        head = reader.data
+        if head[pos] != 0xFF:
+            raise UploadRejected('corrupt_header', 'This JPEG file looks damaged.')
+        marker = head[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            pos += 2
+            continue
+        if marker == 0xD9 or marker == 0xDA:  # end of image / start of scan before any frame
+            break
+        (length,) = struct.unpack('>H', head[pos + 2:pos + 4])
+        if length < 2:
+            break
+        if marker in JPEG_SOF_MARKERS:
+            if not reader.has(pos + 9):
+                break
+            height, width = struct.unpack('>HH', reader.data[pos + 5:pos + 9])
+            return ImageInfo('jpeg', width, height, 'jpg')
+        pos += 2 + length
+    raise UploadRejected('corrupt_header', "We couldn't read this JPEG's dimensions.")
+
+
+def sniff_stream(stream, max_pixels=MAX_PIXELS, max_side=MAX_SIDE):
+    """Identify a PNG/JPEG and check its size, reading only as far as its header.
+
+    Nothing is decoded; raises UploadRejected for anything we won't accept.
+    The stream is left part-way through, so seek back before saving it.
+    """
+    reader = _HeadReader(stream)
+    if not reader.has(1):
+        raise UploadRejected('empty', 'The uploaded file is empty.')
+
+    reader.has(len(PNG_SIGNATURE))
+    if reader.data.startswith(PNG_SIGNATURE):
+        info = _png_info(reader)
+    elif reader.data.startswith(JPEG_SOI):
+        info = _jpeg_info(reader)
+    else:
+        raise UploadRejected('unsupported_format', 'Please upload a JPEG or PNG image.', status=415)
+
+    if info.width == 0 or info.height == 0:
+        raise UploadRejected('corrupt_header', 'This image has no pixels.')
+    if info.width > max_side or info.height > max_side or info.width * info.height > max_pixels:
+        raise UploadRejected(
+            'too_many_pixels',
+            f'This image is too large ({info.width}x{info.height}). Please upload a smaller photo.',
+            status=413,
+        )
+    return info
+
+
+def sniff_image(data, max_pixels=MAX_PIXELS, max_side=MAX_SIDE):
+    """sniff_stream() for an image already in memory"""
+    return sniff_stream(io.BytesIO(data), max_pixels, max_side)
+
+
+class _NeedMoreData(Exception):
+    pass
+
+
+class _ReceivedSoFar:
+    """Read side of the bytes received so far; running out means wait for more, not EOF"""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, size=-1):
+        if self._pos >= len(self._data):
+            raise _NeedMoreData()
+        end = len(self._data) if size < 0 else self._pos + size
+        chunk = self._data[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
+
+class HeadCheckedFile:
+    """Wraps the file a multipart upload is spooled into and sniffs it as the bytes arrive.
+
+    write() raises UploadRejected as soon as the header shows the upload is
+    bad, which aborts form parsing before the rest of the body is read or
+    written. Everything else is passed through to the wrapped file.
+    """
+
+    def __init__(self, target, max_pixels=MAX_PIXELS, max_side=MAX_SIDE):
+        self._target = target
+        self._head = b''
+        self._info = None
+        self._limits = (max_pixels, max_side)
+
+    def write(self, data):
+        if self._info is None:
+            self._head += data
+            try:
+                self._info = sniff_stream(_ReceivedSoFar(self._head), *self._limits)
+                self._head = b''
+            except _NeedMoreData:
+                pass
+        return self._target.write(data)
+
+    def image_info(self):
+        """The sniffed ImageInfo once the whole part has arrived; raises UploadRejected if it isn't one"""
+        if self._info is None:
+            self._info = sniff_image(self._head, *self._limits)
+            self._head = b''
+        return self._info
+
+    def __iter__(self):
+        return iter(self._target)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)